@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Markdown to DOCX Conversion Service
+===================================
+
+A small asyncio HTTP server that converts markdown to DOCX on localhost.
+It needs nothing beyond the converters' own dependencies.
+
+Endpoints:
+    POST /convert?backend=hybrid|advanced
+        Markdown as the raw request body, or as the first file part of a
+        multipart/form-data upload. Responds with the DOCX document.
+    GET /health
+        Liveness plus current queue depth.
+    GET /metrics
+        Queue depth, latency percentiles and per-backend error rates (JSON).
+
+Jobs wait in a bounded queue served by a fixed pool of workers. A full
+queue answers 429, and a stopping service or a job that waited longer than
+queue_timeout answers 503, so callers can back off instead of piling up.
+Every hybrid conversion has a pandoc wall-time limit (504 when exceeded),
+and pandoc is killed when the client disconnects or the service stops.
+
+Usage:
+    python conversion_service.py --port 8080 --workers 4 --queue-size 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.parser import BytesParser
+from email.policy import HTTP
+from urllib.parse import parse_qs, urlsplit
+
+from hybrid_converter import (
+    AdvancedMarkdownConverter,
+    ConversionCancelledError,
+    ConversionTimeoutError,
+    HybridMarkdownConverter,
+)
+
+DOCX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+BACKENDS = ('hybrid', 'advanced')
+
+# Number of recent request latencies kept for percentile reporting
+LATENCY_WINDOW = 1000
+
+# Largest request line plus headers accepted, in bytes
+MAX_HEADER_BYTES = 64 * 1024
+
+# Default pandoc wall-time limit per conversion, in seconds
+DEFAULT_CONVERSION_TIMEOUT = 120.0
+
+STATUS_REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    411: 'Length Required',
+    413: 'Payload Too Large',
+    429: 'Too Many Requests',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+    504: 'Gateway Timeout',
+}
+
+
+class HttpError(Exception):
+    """An error that maps directly to an HTTP error response"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ConversionService:
+    """
+    Bounded-queue conversion server built on asyncio streams
+    """
+
+    def __init__(self, host='127.0.0.1', port=8080, workers=4, queue_size=16,
+                 queue_timeout=30.0, max_body_bytes=10 * 1024 * 1024,
+                 timeout=DEFAULT_CONVERSION_TIMEOUT):
+        """
+        workers is the number of conversions run at once, queue_size the
+        number of jobs allowed to wait for a worker, queue_timeout how long
+        (seconds) a job may wait before it is rejected with 503, and timeout
+        the per-conversion pandoc wall-time limit for the hybrid backend.
+        """
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.max_body_bytes = max_body_bytes
+        self.timeout = timeout
+
+        self._queue = None
+        self._executor = None
+        self._worker_tasks = []
+        self._server = None
+        self._accepting = False
+        # Jobs not yet answered, keyed by their result future
+        self._jobs = {}
+
+        self._in_flight = 0
+        self._rejected = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._backend_stats = {backend: {'requests': 0, 'errors': 0} for backend in BACKENDS}
+
+    async def start(self):
+        """
+        Start workers and begin listening
+        """
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port, limit=MAX_HEADER_BYTES)
+        self._accepting = True
+
+        # Report the real port when started with port=0
+        self.port = self._server.sockets[0].getsockname()[1]
+        print(f"Conversion service listening on http://{self.host}:{self.port}")
+
+    async def stop(self):
+        """
+        Stop accepting requests, cancel queued and running jobs with 503
+        and shut down
+        """
+        self._accepting = False
+        self._server.close()
+
+        # Running pandoc processes are killed through their cancel events
+        for job in list(self._jobs.values()):
+            self._cancel_job(job, HttpError(503, 'Service is shutting down'))
+
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        # Wait for cancelled conversions to unwind without blocking the loop
+        await asyncio.get_running_loop().run_in_executor(None, self._executor.shutdown)
+        await self._server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    def metrics(self):
+        """
+        Snapshot of queue, latency and backend statistics
+        """
+        latencies = sorted(self._latencies)
+        backends = {}
+        for backend, stats in self._backend_stats.items():
+            requests = stats['requests']
+            backends[backend] = {
+                'requests': requests,
+                'errors': stats['errors'],
+                'error_rate': stats['errors'] / requests if requests else 0.0,
+            }
+
+        return {
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'queue_size': self.queue_size,
+            'workers': self.workers,
+            'in_flight': self._in_flight,
+            'rejected': self._rejected,
+            'latency_ms': {
+                'p50': _percentile(latencies, 50),
+                'p90': _percentile(latencies, 90),
+                'p99': _percentile(latencies, 99),
+                'samples': len(latencies),
+            },
+            'backends': backends,
+        }
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._queue.get()
+            try:
+                if job['future'].done():
+                    continue
+                job['started'].set_result(None)
+
+                self._in_flight += 1
+                try:
+                    result = await loop.run_in_executor(
+                        self._executor, _convert_markdown, job['backend'], job['markdown'],
+                        self.timeout, job['cancel_event'])
+                except Exception as e:
+                    if not job['future'].done():
+                        job['future'].set_exception(e)
+                else:
+                    if not job['future'].done():
+                        job['future'].set_result(result)
+                finally:
+                    self._in_flight -= 1
+            finally:
+                self._queue.task_done()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            try:
+                status, headers, body = await self._handle_request(reader)
+            except HttpError as e:
+                status, headers, body = _json_response(e.status, {'error': str(e)})
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                status, headers, body = _json_response(400, {'error': 'Malformed request'})
+
+            writer.write(_format_response(status, headers, body))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(self, reader):
+        """
+        Read one request and return (status, headers, body)
+        """
+        head = await reader.readuntil(b'\r\n\r\n')
+        request_line, *header_lines = head.decode('latin-1').split('\r\n')
+        method, target, _ = request_line.split(' ', 2)
+
+        headers = {}
+        for line in header_lines:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        if url.path == '/health':
+            return _json_response(200, {
+                'status': 'ok' if self._accepting else 'stopping',
+                'queue_depth': self._queue.qsize(),
+            })
+        if url.path == '/metrics':
+            return _json_response(200, self.metrics())
+        if url.path != '/convert':
+            raise HttpError(404, f"Unknown path '{url.path}'")
+        if method != 'POST':
+            raise HttpError(405, 'Use POST to convert')
+
+        backend = parse_qs(url.query).get('backend', ['hybrid'])[0]
+        if backend not in BACKENDS:
+            raise HttpError(400, f"Unknown backend '{backend}', expected one of {', '.join(BACKENDS)}")
+
+        # Refuse before reading the body, so rejections cost no upload
+        self._check_capacity()
+        markdown = await self._read_markdown(reader, headers)
+        docx = await self._submit(backend, markdown, reader)
+        return 200, {'Content-Type': DOCX_CONTENT_TYPE}, docx
+
+    async def _read_markdown(self, reader, headers):
+        """
+        Read the request body and extract markdown from it
+        """
+        if 'content-length' not in headers:
+            raise HttpError(411, 'Content-Length is required')
+        length = int(headers['content-length'])
+        if length > self.max_body_bytes:
+            raise HttpError(413, f"Body is {length} bytes, limit is {self.max_body_bytes}")
+
+        body = await reader.readexactly(length)
+
+        content_type = headers.get('content-type', '')
+        if content_type.startswith('multipart/form-data'):
+            markdown = _markdown_from_multipart(content_type, body)
+        else:
+            markdown = body
+
+        # Undecodable input is the client's error, not a backend failure
+        try:
+            markdown.decode('utf-8')
+        except UnicodeDecodeError as e:
+            raise HttpError(400, f"Markdown is not valid UTF-8: {e}")
+        return markdown
+
+    async def _submit(self, backend, markdown, reader):
+        """
+        Queue a conversion and wait for its result.
+        
+        The job is rejected with 503 if no worker picks it up within
+        queue_timeout, and cancelled if the client's connection fails first.
+        """
+        # Capacity may have run out while the body was read
+        self._check_capacity()
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        job = {'backend': backend, 'markdown': markdown, 'future': future,
+               'started': loop.create_future(), 'cancel_event': threading.Event(),
+               'enqueued': time.monotonic()}
+        self._queue.put_nowait(job)
+
+        self._jobs[future] = job
+        watcher = asyncio.create_task(self._watch_disconnect(reader, job))
+        stats = self._backend_stats[backend]
+        stats['requests'] += 1
+        try:
+            try:
+                await asyncio.wait_for(asyncio.shield(job['started']), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self._cancel_job(job, HttpError(503, 'Job waited too long in the queue'))
+            result = await future
+        except (HttpError, ConnectionError):
+            raise
+        except ConversionTimeoutError as e:
+            stats['errors'] += 1
+            raise HttpError(504, str(e))
+        except Exception as e:
+            stats['errors'] += 1
+            raise HttpError(500, f"{backend} conversion failed: {e}")
+        finally:
+            watcher.cancel()
+            del self._jobs[future]
+            self._latencies.append((time.monotonic() - job['enqueued']) * 1000)
+
+        return result
+
+    def _check_capacity(self):
+        """
+        Raise 503 while the service is stopping and 429 while the queue is full
+        """
+        if not self._accepting:
+            raise HttpError(503, 'Service is shutting down')
+        if self._queue.full():
+            self._rejected += 1
+            raise HttpError(429, 'Conversion queue is full, retry later')
+
+    async def _watch_disconnect(self, reader, job):
+        """
+        Cancel job when the client's connection fails before the reply.
+        
+        End of input alone is not a disconnect: a client that shuts down
+        its sending side after the body still waits for the response.
+        """
+        try:
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            self._cancel_job(job, ConnectionResetError('Client disconnected'))
+
+    def _cancel_job(self, job, error):
+        """
+        Answer job with error and stop its conversion, queued or running
+        """
+        job['cancel_event'].set()
+        if not job['future'].done():
+            job['future'].set_exception(error)
+
+
+def _convert_markdown(backend, markdown, timeout=None, cancel_event=None):
+    """
+    Convert markdown bytes with the chosen backend and return DOCX bytes
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise ConversionCancelledError("Conversion cancelled")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        input_path = os.path.join(temp_dir, 'input.md')
+        output_path = os.path.join(temp_dir, 'output.docx')
+        with open(input_path, 'wb') as f:
+            f.write(markdown)
+
+        if backend == 'hybrid':
+            HybridMarkdownConverter(timeout=timeout).convert(input_path, output_path,
+                                                             cancel_event=cancel_event)
+        else:
+            AdvancedMarkdownConverter().convert(input_path, output_path)
+
+        with open(output_path, 'rb') as f:
+            return f.read()
+
+
+def _markdown_from_multipart(content_type, body):
+    """
+    Return the first uploaded part of a multipart/form-data body
+    """
+    message = BytesParser(policy=HTTP).parsebytes(
+        b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body)
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name is not None:
+            payload = part.get_payload(decode=True)
+            # Nested multipart fields have no single payload
+            if not isinstance(payload, bytes):
+                raise HttpError(400, f"Form field '{name}' is not a file or text value")
+            return payload
+    raise HttpError(400, 'Multipart body has no form field')
+
+
+def _percentile(sorted_values, percent):
+    """Nearest-rank percentile of an already sorted list, rounded to 0.1 ms"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, round(percent / 100 * len(sorted_values)) - 1))
+    return round(sorted_values[rank], 1)
+
+
+def _json_response(status, payload):
+    return status, {'Content-Type': 'application/json'}, json.dumps(payload).encode('utf-8')
+
+
+def _format_response(status, headers, body):
+    lines = [f"HTTP/1.1 {status} {STATUS_REASONS.get(status, '')}"]
+    headers = dict(headers, **{'Content-Length': str(len(body)), 'Connection': 'close'})
+    if status in (429, 503):
+        headers['Retry-After'] = '1'
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local markdown to DOCX conversion service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--queue-size', type=int, default=16)
+    parser.add_argument('--queue-timeout', type=float, default=30.0)
+    parser.add_argument('--timeout', type=float, default=DEFAULT_CONVERSION_TIMEOUT,
+                        help='pandoc wall-time limit per conversion, in seconds')
+    args = parser.parse_args()
+
+    service = ConversionService(host=args.host, port=args.port, workers=args.workers,
+                                queue_size=args.queue_size, queue_timeout=args.queue_timeout,
+                                timeout=args.timeout)
+    try:
+        asyncio.run(service.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
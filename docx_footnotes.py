@@ -0,0 +1,91 @@
+"""
+Word footnotes for documents built with python-docx.
+
+python-docx has no footnote API. FootnoteWriter adds w:footnoteReference
+runs to body paragraphs and the matching w:footnote entries to the
+footnotes part, creating that part when the template has none.
+"""
+
+from types import SimpleNamespace
+
+from docx.opc.constants import CONTENT_TYPE as CT, RELATIONSHIP_TYPE as RT
+from docx.opc.oxml import serialize_part_xml
+from docx.opc.packuri import PackURI
+from docx.opc.part import XmlPart
+from docx.oxml import parse_xml
+from docx.oxml.shared import OxmlElement, qn
+from docx.shared import Pt
+from docx.text.paragraph import Paragraph
+from docx.text.run import Run
+
+# Footnotes part for templates that have none, with the separator notes Word expects
+EMPTY_FOOTNOTES_XML = (
+    '<w:footnotes xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    ' xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<w:footnote w:type="separator" w:id="-1"><w:p><w:r><w:separator/></w:r></w:p></w:footnote>'
+    '<w:footnote w:type="continuationSeparator" w:id="0"><w:p><w:r><w:continuationSeparator/></w:r></w:p></w:footnote>'
+    '</w:footnotes>'
+)
+
+# Font size of footnote text
+FOOTNOTE_SIZE = Pt(10)
+
+
+class FootnoteWriter:
+    """
+    Footnotes state for one document part
+    """
+
+    def __init__(self, document_part):
+        try:
+            part = document_part.part_related_by(RT.FOOTNOTES)
+        except KeyError:
+            part = XmlPart(PackURI('/word/footnotes.xml'), CT.WML_FOOTNOTES,
+                           parse_xml(EMPTY_FOOTNOTES_XML), document_part.package)
+            document_part.relate_to(part, RT.FOOTNOTES)
+
+        self.document_part = document_part
+        self.part = part
+        # python-docx has no footnotes part class, so a template's footnotes
+        # load as a plain blob part; edit a parsed copy and write it back in flush
+        self.element = part.element if isinstance(part, XmlPart) else parse_xml(part.blob)
+        ids = [int(footnote.get(qn('w:id'))) for footnote in self.element.findall(qn('w:footnote'))]
+        self.next_id = max(ids + [0]) + 1
+
+    def add(self, paragraph, write_note):
+        """
+        Add a footnote reference to paragraph and a new note.
+
+        write_note is called with the note's Paragraph to fill in its text;
+        hyperlinks added to it are related to the footnotes part.
+        """
+        footnote_id = str(self.next_id)
+        self.next_id += 1
+
+        reference = paragraph.add_run()
+        reference.font.superscript = True
+        reference_mark = OxmlElement('w:footnoteReference')
+        reference_mark.set(qn('w:id'), footnote_id)
+        reference._r.append(reference_mark)
+
+        footnote = OxmlElement('w:footnote')
+        footnote.set(qn('w:id'), footnote_id)
+        self.element.append(footnote)
+        p = OxmlElement('w:p')
+        footnote.append(p)
+
+        note = Paragraph(p, SimpleNamespace(part=self.part))
+        mark = note.add_run()
+        mark.font.superscript = True
+        mark._r.append(OxmlElement('w:footnoteRef'))
+        note.add_run(' ')
+        write_note(note)
+
+        # Include runs nested in hyperlinks, which note.runs leaves out
+        for r in p.iter(qn('w:r')):
+            Run(r, note).font.size = FOOTNOTE_SIZE
+
+    def flush(self):
+        """Write the edited notes back when the footnotes part is a blob part"""
+        if not isinstance(self.part, XmlPart):
+            self.part._blob = serialize_part_xml(self.element)
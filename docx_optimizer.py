@@ -0,0 +1,294 @@
+"""
+Final clean-up stage for generated DOCX packages.
+
+optimize_document removes redundant markup left by the build: empty runs,
+adjacent runs with identical formatting, repeated cell borders, styles that
+nothing references, and relationships (images, hyperlinks, stale template
+parts) that no part uses. save_document then writes the package with a
+chosen zip compression level: 0 stores entries uncompressed (fastest, for
+interactive previews) and 9 compresses hardest (for archival).
+"""
+
+import io
+import shutil
+import zipfile
+
+from docx import Document
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.part import XmlPart
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from lxml import etree
+
+# Relationships that are safe to drop when no rId in the source part uses them
+PRUNABLE_RELATIONSHIPS = {RT.IMAGE, RT.HYPERLINK}
+
+# Template parts Word does not need: the Word 2010 styles copy and the
+# package thumbnail, which no longer matches the generated content
+STALE_RELATIONSHIPS = {
+    'http://schemas.microsoft.com/office/2007/relationships/stylesWithEffects',
+    RT.THUMBNAIL,
+}
+
+# Elements whose w:val names a style
+STYLE_REFERENCES = {qn('w:pStyle'), qn('w:rStyle'), qn('w:tblStyle'),
+                    qn('w:numStyleLink'), qn('w:styleLink')}
+
+# Style elements that name another style the referencing style depends on
+STYLE_DEPENDENCIES = (qn('w:basedOn'), qn('w:next'), qn('w:link'))
+
+R_NAMESPACE = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+
+
+def optimize_document(document, prune_runs=True, merge_runs=True, prune_styles=True,
+                      prune_parts=True, references=None):
+    """
+    Remove redundant markup from a python-docx Document in place.
+
+    references, from add_references, lists the styles and relationships
+    used by body content held outside the document (see save_document's
+    splice), so they are kept. Returns a dict counting what was removed.
+    """
+    stats = optimize_element(document.element.body, prune_runs, merge_runs)
+    stats.update(styles=0, relationships=0)
+
+    if prune_styles:
+        stats['styles'] = _prune_styles(document, references)
+
+    if prune_parts:
+        stats['relationships'] = _prune_relationships(document, references)
+
+    return stats
+
+
+def optimize_element(element, prune_runs=True, merge_runs=True):
+    """
+    Remove redundant runs and cell borders within one element tree.
+
+    Returns a dict counting what was removed.
+    """
+    stats = {'empty_runs': 0, 'merged_runs': 0, 'cell_borders': 0}
+
+    if prune_runs:
+        for run in list(element.iter(qn('w:r'))):
+            if _is_empty_run(run):
+                run.getparent().remove(run)
+                stats['empty_runs'] += 1
+
+    if merge_runs:
+        stats['merged_runs'] = _merge_adjacent_runs(element)
+
+    for tcPr in element.iter(qn('w:tcPr')):
+        # Only one w:tcBorders is valid; the last one added is the intended one
+        for borders in tcPr.findall(qn('w:tcBorders'))[:-1]:
+            tcPr.remove(borders)
+            stats['cell_borders'] += 1
+
+    return stats
+
+
+def add_references(element, references):
+    """
+    Record the style ids and relationship ids element uses.
+
+    references is a dict of two sets, {'styles': ..., 'relationships': ...}.
+    """
+    for reference in element.iter(*STYLE_REFERENCES):
+        references['styles'].add(reference.get(qn('w:val')))
+    references['relationships'].update(_relationship_ids(element))
+
+
+def save_document(document, path, compression_level=None, splice=None):
+    """
+    Save document, re-compressing the package when compression_level is set.
+
+    compression_level 0 stores entries uncompressed; 1-9 are deflate levels.
+    None keeps python-docx's default deflate setting.
+
+    splice is an optional (marker, source) pair: the XML comment
+    <!--marker--> in the main document part is replaced by the contents of
+    the binary file object source, which is streamed into the package so a
+    large body never has to be held in memory.
+    """
+    check_compression_level(compression_level)
+    if compression_level is None and splice is None:
+        document.save(path)
+        return
+
+    buffer = io.BytesIO()
+    document.save(buffer)
+    buffer.seek(0)
+    if splice is not None:
+        splice = (document.part.partname.membername, *splice)
+    _recompress(buffer, path, compression_level, splice)
+
+
+def check_compression_level(compression_level):
+    """Raise ValueError unless compression_level is None or an int from 0 to 9"""
+    if compression_level is None:
+        return
+    if (not isinstance(compression_level, int) or isinstance(compression_level, bool)
+            or not 0 <= compression_level <= 9):
+        raise ValueError(f"compression_level must be an integer from 0 to 9, got {compression_level!r}")
+
+
+def optimize_docx(input_path, output_path=None, compression_level=None, **options):
+    """
+    Optimize an existing DOCX file, overwriting it unless output_path is given
+    """
+    document = Document(input_path)
+    stats = optimize_document(document, **options)
+    save_document(document, output_path or input_path, compression_level)
+    return stats
+
+
+def _is_empty_run(run):
+    """A run with no text and nothing else (breaks, fields, drawings) inside"""
+    for child in run:
+        if child.tag == qn('w:rPr'):
+            continue
+        if child.tag == qn('w:t') and not child.text:
+            continue
+        return False
+    return True
+
+
+def _is_text_run(run):
+    return all(child.tag in (qn('w:rPr'), qn('w:t')) for child in run)
+
+
+def _run_properties(run):
+    rPr = run.find(qn('w:rPr'))
+    return b'' if rPr is None else etree.tostring(rPr)
+
+
+def _merge_adjacent_runs(element):
+    """Join neighbouring text-only runs that share identical properties"""
+    merged = 0
+    for paragraph in element.iter(qn('w:p'), qn('w:hyperlink')):
+        previous = None
+        for child in list(paragraph):
+            if child.tag != qn('w:r') or not _is_text_run(child):
+                previous = None
+                continue
+            if previous is not None and _run_properties(previous) == _run_properties(child):
+                texts = previous.findall(qn('w:t')) + child.findall(qn('w:t'))
+                target = texts[0]
+                target.text = ''.join(t.text or '' for t in texts)
+                target.set(qn('xml:space'), 'preserve')
+                for t in texts[1:]:
+                    t.getparent().remove(t)
+                paragraph.remove(child)
+                merged += 1
+            else:
+                previous = child
+    return merged
+
+
+def _prune_styles(document, references=None):
+    """Drop styles that no part references, keeping defaults and dependencies"""
+    styles_element = document.styles.element
+    styles_part = document.part.part_related_by(RT.STYLES)
+
+    used = set(references['styles']) if references else set()
+    for part in document.part.package.iter_parts():
+        if part is styles_part:
+            continue
+        if isinstance(part, XmlPart):
+            element = part.element
+        elif part.content_type.endswith('+xml'):
+            # Parts python-docx has no class for (footnotes, endnotes, ...)
+            element = parse_xml(part.blob)
+        else:
+            continue
+        for reference in element.iter(*STYLE_REFERENCES):
+            used.add(reference.get(qn('w:val')))
+
+    by_id = {style.get(qn('w:styleId')): style for style in styles_element.findall(qn('w:style'))}
+    pending = [style_id for style_id, style in by_id.items()
+               if style_id in used or style.get(qn('w:default')) in ('1', 'true')]
+    keep = set()
+    while pending:
+        style_id = pending.pop()
+        if style_id in keep or style_id not in by_id:
+            continue
+        keep.add(style_id)
+        for tag in STYLE_DEPENDENCIES:
+            dependency = by_id[style_id].find(tag)
+            if dependency is not None:
+                pending.append(dependency.get(qn('w:val')))
+
+    removed = 0
+    for style_id, style in by_id.items():
+        if style_id not in keep:
+            styles_element.remove(style)
+            removed += 1
+    return removed
+
+
+def _prune_relationships(document, references=None):
+    """Drop unused image/hyperlink relationships and stale template parts"""
+    package = document.part.package
+    removed = 0
+
+    for rId, rel in list(package.rels.items()):
+        if rel.reltype in STALE_RELATIONSHIPS:
+            del package.rels[rId]
+            removed += 1
+
+    for part in list(package.iter_parts()):
+        if not isinstance(part, XmlPart):
+            continue
+        referenced = _relationship_ids(part.element)
+        if references and part is document.part:
+            referenced |= references['relationships']
+        for rId, rel in list(part.rels.items()):
+            if rel.reltype in STALE_RELATIONSHIPS or (
+                    rel.reltype in PRUNABLE_RELATIONSHIPS and rId not in referenced):
+                del part.rels[rId]
+                removed += 1
+
+    return removed
+
+
+def _relationship_ids(element):
+    """Values of every r: attribute (r:id, r:embed, ...) within element"""
+    return {
+        value
+        for child in element.iter()
+        for name, value in child.attrib.items()
+        if name.startswith(R_NAMESPACE)
+    }
+
+
+def _recompress(source, path, compression_level, splice=None):
+    """
+    Copy a zip package entry by entry at the given compression level,
+    splicing streamed content into one entry when splice is given
+    """
+    if compression_level == 0:
+        options = {'compression': zipfile.ZIP_STORED}
+    else:
+        options = {'compression': zipfile.ZIP_DEFLATED, 'compresslevel': compression_level}
+
+    with zipfile.ZipFile(source) as src, zipfile.ZipFile(path, 'w', **options) as dst:
+        for info in src.infolist():
+            if splice is not None and info.filename == splice[0]:
+                _write_spliced(dst, src.read(info.filename), *splice)
+            else:
+                dst.writestr(info.filename, src.read(info.filename))
+
+
+def _write_spliced(dst, xml, member, marker, source):
+    """Write member with the <!--marker--> comment replaced by source"""
+    before, found, after = xml.partition(b'<!--' + marker.encode('utf-8') + b'-->')
+    if not found:
+        raise ValueError(f"Splice marker not found in '{member}'")
+
+    source.seek(0, io.SEEK_END)
+    size = len(before) + source.tell() + len(after)
+    source.seek(0)
+    with dst.open(member, 'w', force_zip64=size > zipfile.ZIP64_LIMIT) as f:
+        f.write(before)
+        shutil.copyfileobj(source, f)
+        f.write(after)
@@ -1,45 +1,168 @@
 import pypandoc
 from docx import Document
-from docx.shared import Inches, Pt
+from docx.shared import Inches, Pt, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.table import WD_TABLE_ALIGNMENT
 from docx.oxml.shared import OxmlElement, qn
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from lxml import etree
 import os
+import signal
+import subprocess
 import tempfile
+import time
 import re
+import json
+import hashlib
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from inline_parser import DefinitionIndex, parse_inline
+from docx_footnotes import FootnoteWriter
+from docx_optimizer import (
+    add_references,
+    check_compression_level,
+    optimize_document,
+    optimize_element,
+    save_document,
+)
+
+# Format version written by AdvancedMarkdownConverter.save_blocks
+BLOCK_TREE_VERSION = 2
+
+# Word's default hyperlink blue
+HYPERLINK_COLOR = RGBColor(0x05, 0x63, 0xC1)
+
+# Approximate XML bytes a block adds beyond its text (paragraph and run markup)
+BLOCK_XML_OVERHEAD = 200
+
+# Deepest heading level listed in generated tables of contents
+TOC_LEVELS = 3
+
+# Chapter prefixes and anchors that can appear readably in a bookmark name
+BOOKMARK_PART = re.compile(r'(?:[A-Za-z0-9]+(?:-[A-Za-z0-9]+)*)?\Z')
+
+# Default for AdvancedMarkdownConverter.render: use the converter's template
+CONVERTER_TEMPLATE = object()
+
+# Seconds between checks for timeout and cancellation while pandoc runs
+PANDOC_POLL_INTERVAL = 0.1
+
+# "## Heading ##" and the underlines of setext headings
+ATX_HEADING = re.compile(r'^(#{1,6})\s+(.*?)(?:\s+#+)?\s*$')
+SETEXT_UNDERLINE = re.compile(r'^(=+|-+)\s*$')
+
+# Lines that cannot be the text of a setext heading (lists, quotes, tables)
+NOT_SETEXT_TEXT = re.compile(r'^\s*(?:[-*+>|#]|\d+\.)')
+
+# Trailing pandoc attribute block of a heading: {#id .class key=value}
+HEADING_ATTRIBUTES = re.compile(r'\s*\{([^{}]*)\}\s*$')
+
+# Paragraph styles of the title block pandoc puts before the contents
+PANDOC_TITLE_STYLES = {'Title', 'Subtitle', 'Author', 'Date', 'Abstract'}
+
+
+class ConversionError(Exception):
+    """Base class for conversion failures raised by the converters"""
+
+
+class ConversionTimeoutError(ConversionError):
+    """The pandoc subprocess exceeded its wall-time limit and was killed"""
+
+
+class ConversionCancelledError(ConversionError):
+    """The conversion was cancelled through its cancel_event"""
+
+
+class InputTooLargeError(ConversionError):
+    """The markdown input exceeds the configured size limit"""
+
 
 class HybridMarkdownConverter:
-    def __init__(self, template_path=None):
-        self.template_path = template_path
+    def __init__(self, template_path=None, timeout=None, max_input_bytes=None,
+                 pandoc_rts_options=None, optimize=False, compression_level=None):
+        """
+        timeout is the wall-time limit in seconds for the pandoc subprocess,
+        max_input_bytes rejects larger markdown files before pandoc starts,
+        and pandoc_rts_options are passed to pandoc's runtime between
+        +RTS and -RTS (for example ['-M512M'] to cap its heap).
         
-    def convert(self, markdown_file_path, output_docx_path, enhance_formatting=True):
+        optimize runs docx_optimizer over the output before saving, and
+        compression_level (0-9) sets the zip compression of the saved file.
+        """
+        check_compression_level(compression_level)
+        self.template_path = template_path
+        self.optimize = optimize
+        self.compression_level = compression_level
+        self.timeout = timeout
+        self.max_input_bytes = max_input_bytes
+        self.pandoc_rts_options = pandoc_rts_options or []
+    
+    def convert(self, markdown_file_path, output_docx_path, enhance_formatting=True,
+                cancel_event=None, toc=True):
         """
         Convert markdown to docx using pypandoc, then enhance with python-docx
+        
+        cancel_event is an optional threading.Event; setting it from another
+        thread kills a running pandoc process and raises
+        ConversionCancelledError.
+        
+        With toc=True a document with headings gets a table of contents,
+        pre-rendered and linked to pandoc's heading bookmarks, so it reads
+        correctly without Word recomputing a TOC field on open.
         """
+        temp_docx = None
         try:
+            self._check_input_size(markdown_file_path)
+            headings = self.outline(markdown_file_path) if toc else []
+            
             # First, convert using pypandoc
-            temp_docx = self._convert_with_pypandoc(markdown_file_path)
+            temp_docx = self._convert_with_pypandoc(markdown_file_path, cancel_event)
+            self._check_cancelled(cancel_event)
             
             if enhance_formatting:
                 # Then enhance the formatting with python-docx
-                self._enhance_formatting(temp_docx, output_docx_path)
+                self._enhance_formatting(temp_docx, output_docx_path, headings)
+            elif headings or self.optimize or self.compression_level is not None:
+                doc = Document(temp_docx)
+                self._add_toc(doc, headings)
+                self._save(doc, output_docx_path)
             else:
                 # Just copy the pypandoc output
                 import shutil
                 shutil.copy(temp_docx, output_docx_path)
             
-            # Clean up temporary file
-            os.unlink(temp_docx)
-            
             print(f"Successfully converted '{markdown_file_path}' to '{output_docx_path}'")
-            
+        
         except Exception as e:
             print(f"Error converting '{markdown_file_path}': {e}")
             raise
+        
+        finally:
+            # Clean up temporary file
+            if temp_docx and os.path.exists(temp_docx):
+                os.unlink(temp_docx)
+    
+    def _check_input_size(self, markdown_file_path):
+        """
+        Reject inputs larger than max_input_bytes
+        """
+        if self.max_input_bytes is None:
+            return
+        size = os.path.getsize(markdown_file_path)
+        if size > self.max_input_bytes:
+            raise InputTooLargeError(
+                f"'{markdown_file_path}' is {size} bytes, limit is {self.max_input_bytes}")
     
-    def _convert_with_pypandoc(self, markdown_file_path):
+    def _check_cancelled(self, cancel_event):
+        if cancel_event is not None and cancel_event.is_set():
+            raise ConversionCancelledError("Conversion cancelled")
+    
+    def _convert_with_pypandoc(self, markdown_file_path, cancel_event=None):
         """
-        Use pypandoc for initial conversion
+        Use the pandoc binary located by pypandoc for initial conversion.
+        
+        Pandoc runs as a subprocess we control, so it can be killed on
+        timeout or cancellation; the temporary output is removed either way.
         """
         # Create temporary output file
         temp_fd, temp_path = tempfile.mkstemp(suffix='.docx')
@@ -50,31 +173,164 @@ class HybridMarkdownConverter:
             '--reference-doc=' + self.template_path if self.template_path else None,
             '--wrap=none',  # Don't wrap lines
             '--standalone',  # Produce standalone document
-            '--table-of-contents' if self._has_headings(markdown_file_path) else None,
         ]
         
         # Filter out None values
         extra_args = [arg for arg in extra_args if arg is not None]
         
-        # Convert markdown to docx
-        pypandoc.convert_file(
-            markdown_file_path,
-            'docx',
-            outputfile=temp_path,
-            extra_args=extra_args
-        )
+        command = [pypandoc.get_pandoc_path(), markdown_file_path,
+                   # GitHub-style ids, so outline() anchors match pandoc's bookmarks
+                   '--from=markdown+gfm_auto_identifiers', '--to=docx',
+                   '--output=' + temp_path]
+        if self.pandoc_rts_options:
+            command += ['+RTS', *self.pandoc_rts_options, '-RTS']
+        command += extra_args
+        
+        try:
+            self._run_pandoc(command, cancel_event)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
         
         return temp_path
     
-    def _has_headings(self, markdown_file_path):
+    def _run_pandoc(self, command, cancel_event=None):
         """
-        Check if markdown file has headings (for TOC generation)
+        Run pandoc, killing it when the timeout passes or cancel_event is set
         """
+        deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        # A new session puts pandoc, its filters and any wrapper script in
+        # one process group that can be killed together
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                   start_new_session=True)
+        
+        try:
+            while True:
+                try:
+                    _, stderr = process.communicate(timeout=PANDOC_POLL_INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                
+                if cancel_event is not None and cancel_event.is_set():
+                    raise ConversionCancelledError("Conversion cancelled")
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise ConversionTimeoutError(f"pandoc did not finish within {self.timeout} seconds")
+        except BaseException:
+            self._kill_pandoc(process)
+            raise
+        
+        if process.returncode != 0:
+            raise ConversionError(
+                f"pandoc exited with status {process.returncode}: "
+                f"{stderr.decode('utf-8', errors='replace').strip()}")
+    
+    def _kill_pandoc(self, process):
+        """
+        Kill pandoc and everything it started, then reap it
+        """
+        if hasattr(os, 'killpg'):
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        else:
+            process.kill()
+        process.communicate()
+    
+    def outline(self, markdown_file_path):
+        """
+        Return the document's headings without running pandoc.
+        
+        Each entry is a dict with level, text, anchor and line, as returned
+        by AdvancedMarkdownConverter.outline. Pandoc runs with GitHub-style
+        identifiers, and explicit {#id} attributes are honoured, so anchor is
+        the name of the bookmark convert() gives the heading. The file is
+        streamed line by line; headings inside fenced code blocks don't count.
+        """
+        headings = []
+        anchors = {}
+        in_code_block = False
+        in_metadata = False
+        previous = ''
+        
         with open(markdown_file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return bool(re.search(r'^#+\s+', content, re.MULTILINE))
+            for number, line in enumerate(f, 1):
+                line = line.rstrip('\r\n')
+                # A leading YAML metadata block ends at '---' or '...'
+                if number == 1 and line == '---':
+                    in_metadata = True
+                    continue
+                if in_metadata:
+                    in_metadata = line not in ('---', '...')
+                    continue
+                if line.startswith('```'):
+                    in_code_block = not in_code_block
+                    previous = ''
+                    continue
+                if in_code_block:
+                    continue
+                
+                match = ATX_HEADING.match(line)
+                underline = SETEXT_UNDERLINE.match(line)
+                if match:
+                    level, text, line_number = len(match.group(1)), match.group(2), number
+                elif underline and previous.strip() and not NOT_SETEXT_TEXT.match(previous):
+                    level = 1 if underline.group(1)[0] == '=' else 2
+                    text, line_number = previous.strip(), number - 1
+                else:
+                    previous = line
+                    continue
+                
+                # A trailing {#id .class} block sets pandoc's id explicitly
+                attributes = HEADING_ATTRIBUTES.search(text)
+                explicit_id = None
+                if attributes:
+                    text = text[:attributes.start()]
+                    explicit_id = re.search(r'#([^\s}]+)', attributes.group(1))
+                if explicit_id:
+                    anchor = explicit_id.group(1)
+                    # Generated ids skip the ones already taken
+                    anchors.setdefault(anchor, 1)
+                else:
+                    anchor = _unique_anchor(_slugify(text), anchors)
+                headings.append({'level': level, 'text': text, 'anchor': anchor,
+                                 'line': line_number})
+                previous = ''
+        
+        return headings
+    
+    def _add_toc(self, doc, headings):
+        """
+        Insert a table of contents linked to pandoc's heading bookmarks.
+        
+        headings is the outline scanned before pandoc ran; when it is empty
+        no contents are added. The entries come from the heading paragraphs
+        pandoc bookmarked, so they link to pandoc's own anchors and show the
+        heading text as pandoc rendered it (inline markup removed).
+        """
+        if not headings:
+            return
+        
+        entries = []
+        for p in doc.element.body.iterchildren(qn('w:p')):
+            match = re.match(r'^Heading(\d)$', p.style or '')
+            bookmark = p.find(qn('w:bookmarkStart'))
+            if match and bookmark is not None and int(match.group(1)) <= TOC_LEVELS:
+                text = ''.join(t.text or '' for t in p.iter(qn('w:t')))
+                entries.append((int(match.group(1)), text, bookmark.get(qn('w:name'))))
+        if not entries:
+            return
+        
+        # Contents go after pandoc's title block, if there is one
+        position = None
+        for element in doc.element.body.iterchildren():
+            if element.tag != qn('w:p') or element.style not in PANDOC_TITLE_STYLES:
+                break
+            position = element
+        _insert_toc(doc, position, entries)
     
-    def _enhance_formatting(self, input_docx_path, output_docx_path):
+    def _enhance_formatting(self, input_docx_path, output_docx_path, headings=None):
         """
         Enhance the pypandoc output with python-docx
         """
@@ -89,8 +345,19 @@ class HybridMarkdownConverter:
         # Enhance lists
         self._enhance_lists(doc)
         
+        # Add the table of contents after the enhancements so they leave it alone
+        self._add_toc(doc, headings)
+        
         # Save the enhanced document
-        doc.save(output_docx_path)
+        self._save(doc, output_docx_path)
+    
+    def _save(self, document, output_docx_path):
+        """
+        Save document, optimizing and re-compressing it if configured
+        """
+        if self.optimize:
+            optimize_document(document)
+        save_document(document, output_docx_path, self.compression_level)
     
     def _enhance_tables(self, doc):
         """
@@ -118,6 +385,10 @@ class HybridMarkdownConverter:
         tc = cell._tc
         tcPr = tc.get_or_add_tcPr()
         
+        # Replace any existing borders instead of stacking another element
+        for existing in tcPr.findall(qn('w:tcBorders')):
+            tcPr.remove(existing)
+        
         # Create borders element
         tcBorders = OxmlElement('w:tcBorders')
         
@@ -160,63 +431,382 @@ class HybridMarkdownConverter:
 class AdvancedMarkdownConverter:
     """
     Extended converter with custom parsing for advanced markdown elements
+    
+    Conversion happens in two stages: ``parse`` turns markdown into a compact
+    block tree (plain lists and dicts, JSON serializable) and ``render`` writes
+    that tree into a document. A parsed tree can be saved, reloaded and
+    rendered against any number of templates without re-reading the source.
     """
     
-    def __init__(self, template_path=None):
+    def __init__(self, template_path=None, optimize=False, compression_level=None):
+        check_compression_level(compression_level)
         self.template_path = template_path
+        # Final output stage, see docx_optimizer
+        self.optimize = optimize
+        self.compression_level = compression_level
         if template_path:
             self.document = Document(template_path)
         else:
             self.document = Document()
+        
+        # Bookmark ids must be unique within a document
+        self._next_bookmark_id = 0
+        # Absolute chapter path -> anchor prefix, filled in book mode
+        self._book_chapters = {}
+        self._chapter = ''
+        # Directory of the chapter being rendered; cross-file links are relative to it
+        self._chapter_dir = ''
+        # Headings collected for the table of contents while rendering
+        self._toc_entries = None
+        # Footnotes part of the document being rendered, see _footnotes_for
+        self._footnotes = None
+        # Link and footnote definitions of the document being parsed
+        self._definitions = None
+        # (document part, {bookmark name: (chapter, anchor)}), see _claim_bookmark
+        self._bookmarks = None
     
-    def convert(self, markdown_file_path, output_docx_path):
+    def convert(self, markdown_file_path, output_docx_path, toc=False):
         """
         Convert markdown with full custom parsing
+        
+        With toc=True a table of contents, pre-rendered from the parsed
+        headings, is placed at the start of the document.
+        """
+        blocks = self.parse(markdown_file_path)
+        
+        # Render into this converter's document and save it
+        toc_position = self._start_toc(self.document, toc)
+        self._render_blocks(self.document, blocks)
+        self._finish_toc(self.document, toc_position)
+        self._save(self.document, output_docx_path)
+        print(f"Successfully converted '{markdown_file_path}' to '{output_docx_path}'")
+    
+    def convert_book(self, chapters, output_docx_path, page_breaks=True, toc=False):
+        """
+        Convert an ordered list of chapter files into a single document.
+        
+        chapters is either a list of markdown paths or the path of a manifest
+        file listing one chapter per line (relative to the manifest; blank
+        lines and lines starting with '#' are ignored). Chapters are parsed
+        and rendered one at a time, and each rendered chapter body is spooled
+        to a temporary file and spliced into the package on save, so memory
+        stays proportional to one chapter (plus the book's footnotes and
+        link relationships). Links such as [Setup](02-setup.md#install),
+        relative to the linking chapter, resolve to the matching heading in
+        the assembled document.
+        """
+        if isinstance(chapters, (str, os.PathLike)):
+            base_dir = os.path.dirname(os.path.abspath(chapters))
+            chapters = self._read_manifest(chapters)
+        elif chapters:
+            base_dir = os.path.commonpath([os.path.dirname(os.path.abspath(path))
+                                           for path in chapters])
+        else:
+            base_dir = ''
+        
+        self._book_chapters = _chapter_prefixes(chapters, base_dir)
+        
+        toc_position = self._start_toc(self.document, toc)
+        spool = self._start_spool(self.document)
+        try:
+            try:
+                for index, chapter_path in enumerate(chapters):
+                    if index and page_breaks:
+                        self.document.add_page_break()
+                    
+                    chapter_path = os.path.abspath(chapter_path)
+                    chapter = self._book_chapters[chapter_path]
+                    self._chapter_dir = os.path.dirname(chapter_path)
+                    self._add_bookmark_marker(self.document,
+                                              self._claim_bookmark(self.document, chapter, ''))
+                    self._render_blocks(self.document, self.parse(chapter_path), chapter)
+                    self._spool_body(spool)
+            finally:
+                self._book_chapters = {}
+                self._chapter_dir = ''
+            self._finish_toc(self.document, toc_position)
+            
+            self._save(self.document, output_docx_path, spool)
+        finally:
+            spool['file'].close()
+        print(f"Successfully converted {len(chapters)} chapters to '{output_docx_path}'")
+    
+    def _start_spool(self, document):
+        """
+        Mark where spooled body content will be spliced back in on save
+        """
+        marker = f"book-body-{uuid.uuid4().hex}"
+        comment = etree.Comment(marker)
+        sectPr = document.element.body.find(qn('w:sectPr'))
+        if sectPr is not None:
+            sectPr.addprevious(comment)
+        else:
+            document.element.body.append(comment)
+        
+        return {'marker': marker, 'comment': comment, 'file': tempfile.TemporaryFile(),
+                'references': {'styles': set(), 'relationships': set()}}
+    
+    def _spool_body(self, spool):
+        """
+        Move everything rendered after the spool marker out to the spool file
+        """
+        comment = spool['comment']
+        while comment.getnext() is not None and comment.getnext().tag != qn('w:sectPr'):
+            element = comment.getnext()
+            if self.optimize:
+                optimize_element(element)
+                add_references(element, spool['references'])
+            # Serialize in place so namespace declarations come from the document
+            spool['file'].write(etree.tostring(element, encoding='UTF-8'))
+            comment.getparent().remove(element)
+
+    def _read_manifest(self, manifest_path):
+        """Read chapter paths from a book manifest"""
+        base_dir = os.path.dirname(os.path.abspath(manifest_path))
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            entries = [line.strip() for line in f]
+        return [os.path.join(base_dir, entry) for entry in entries
+                if entry and not entry.startswith('#')]
+
+    def parse(self, markdown_file_path):
+        """
+        Parse a markdown file into a block tree
         """
         with open(markdown_file_path, 'r', encoding='utf-8') as f:
             content = f.read()
         
-        # Parse and convert all elements
-        self._parse_content(content)
+        return self._parse_content(content)
+    
+    def outline(self, markdown_file_path):
+        """
+        Return the document's headings without rendering anything.
         
-        # Save document
-        self.document.save(output_docx_path)
-        print(f"Successfully converted '{markdown_file_path}' to '{output_docx_path}'")
+        Each entry is a dict with level, text, anchor (the GitHub-style
+        '#anchor' links resolve to) and line (1-based source line).
+        """
+        return [
+            {key: block[key] for key in ('level', 'text', 'anchor', 'line')}
+            for block in self.parse(markdown_file_path)
+            if block['type'] == 'heading'
+        ]
+    
+    def render(self, blocks, output_docx_path, template_path=CONVERTER_TEMPLATE, toc=False):
+        """
+        Render a parsed block tree into a fresh document based on template_path.
+        
+        template_path defaults to the converter's own template; pass None
+        for python-docx's default template.
+        """
+        if template_path is CONVERTER_TEMPLATE:
+            template_path = self.template_path
+        document = Document(template_path) if template_path else Document()
+        toc_position = self._start_toc(document, toc)
+        self._render_blocks(document, blocks)
+        self._finish_toc(document, toc_position)
+        self._save(document, output_docx_path)
+        return output_docx_path
+    
+    def render_templates(self, blocks, outputs, max_workers=None):
+        """
+        Render one block tree against several templates in parallel.
+        
+        outputs maps each template_path (None for the default template) to
+        its output path. Returns the list of written output paths.
+        """
+        jobs = [(blocks, output_path, template_path)
+                for template_path, output_path in outputs.items()]
+        return self._render_many(jobs, max_workers)
+    
+    def convert_split(self, markdown_file_path, output_dir, split_level=None,
+                      max_paragraphs=None, max_bytes=None, max_workers=None):
+        """
+        Convert one markdown file into several smaller documents plus an index.
+        
+        A new part starts at every heading of split_level or above, and
+        whenever the current part would exceed max_paragraphs paragraphs or
+        roughly max_bytes of document XML. Parts are written in parallel to
+        output_dir as <stem>_part001.docx, ... and <stem>_index.docx links
+        to each of them. Returns (index_path, part_paths).
+        """
+        if split_level is None and max_paragraphs is None and max_bytes is None:
+            raise ValueError("convert_split needs split_level, max_paragraphs or max_bytes")
+        
+        parts = self._split_blocks(self.parse(markdown_file_path), split_level,
+                                   max_paragraphs, max_bytes)
+        
+        os.makedirs(output_dir, exist_ok=True)
+        stem = os.path.splitext(os.path.basename(markdown_file_path))[0]
+        part_paths = [os.path.join(output_dir, f"{stem}_part{n:03d}.docx")
+                      for n in range(1, len(parts) + 1)]
+        self._link_parts(parts, part_paths)
+        
+        self._render_many([(part, path, self.template_path)
+                           for part, path in zip(parts, part_paths)], max_workers)
+        
+        index_path = os.path.join(output_dir, f"{stem}_index.docx")
+        self._write_split_index(stem, parts, part_paths, index_path)
+        
+        print(f"Successfully converted '{markdown_file_path}' into {len(parts)} parts in '{output_dir}'")
+        return index_path, part_paths
+    
+    def _split_blocks(self, blocks, split_level, max_paragraphs, max_bytes):
+        """Group blocks into parts by heading level and size budget"""
+        parts = []
+        current = []
+        paragraphs = 0
+        size = 0
+        
+        for block in blocks:
+            block_paragraphs = 1 + len(block.get('rows', ()))
+            block_size = _estimate_block_bytes(block)
+            
+            starts_part = (
+                split_level is not None and block['type'] == 'heading'
+                and block['level'] <= split_level
+            )
+            over_budget = (
+                (max_paragraphs is not None and paragraphs + block_paragraphs > max_paragraphs)
+                or (max_bytes is not None and size + block_size > max_bytes)
+            )
+            
+            if current and (starts_part or over_budget):
+                parts.append(current)
+                current = []
+                paragraphs = 0
+                size = 0
+            
+            current.append(block)
+            paragraphs += block_paragraphs
+            size += block_size
+        
+        if current or not parts:
+            parts.append(current)
+        return parts
+    
+    def _link_parts(self, parts, part_paths):
+        """
+        Point '#anchor' links at headings in another part to that part's file
+        """
+        owners = {block['anchor']: number
+                  for number, part in enumerate(parts)
+                  for block in part if block['type'] == 'heading'}
+        
+        for number, part in enumerate(parts):
+            for block in part:
+                for span in _link_spans(block.get('spans', ())):
+                    owner = owners.get(span[2][1:]) if span[2].startswith('#') else None
+                    if owner is not None and owner != number:
+                        bookmark = _bookmark_name('', span[2][1:])
+                        span[2] = f"{os.path.basename(part_paths[owner])}#{bookmark}"
+    
+    def _write_split_index(self, title, parts, part_paths, index_path):
+        """Write a document linking to every part of a split conversion"""
+        document = Document(self.template_path) if self.template_path else Document()
+        document.add_heading(title, level=1)
+        
+        for number, (part, part_path) in enumerate(zip(parts, part_paths), 1):
+            heading = next((block['text'] for block in part if block['type'] == 'heading'), None)
+            label = f"Part {number}: {heading}" if heading else f"Part {number}"
+            
+            p = document.add_paragraph(style='List Number')
+            # Relative link, so the index keeps working when the folder moves
+            url = os.path.relpath(part_path, os.path.dirname(index_path))
+            run = p.add_run(label)
+            run.underline = True
+            _wrap_in_hyperlink(p, run, url=url)
+        
+        self._save(document, index_path)
+    
+    def _save(self, document, output_docx_path, spool=None):
+        """
+        Save document, optimizing and re-compressing it if configured.
+        
+        spool is the body content written out by _spool_body, if any.
+        """
+        self._flush_footnotes(document)
+        if self.optimize:
+            optimize_document(document, references=spool and spool['references'])
+        splice = (spool['marker'], spool['file']) if spool else None
+        save_document(document, output_docx_path, self.compression_level, splice)
+    
+    def _render_many(self, jobs, max_workers=None):
+        """
+        Render (blocks, output_path, template_path) jobs, in parallel
+        processes when there is more than one.
+        """
+        if len(jobs) <= 1 or max_workers == 1:
+            return [self.render(blocks, output_path, template_path)
+                    for blocks, output_path, template_path in jobs]
+        
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_render_blocks_to_file, *job, self.optimize, self.compression_level)
+                for job in jobs
+            ]
+            return [future.result() for future in futures]
+    
+    @staticmethod
+    def save_blocks(blocks, path):
+        """
+        Write a parsed block tree to disk for later rendering
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'version': BLOCK_TREE_VERSION, 'blocks': blocks}, f,
+                      ensure_ascii=False, separators=(',', ':'))
+    
+    @staticmethod
+    def load_blocks(path):
+        """
+        Read a block tree written by save_blocks
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('version') != BLOCK_TREE_VERSION:
+            raise ValueError(f"Unsupported block tree version in '{path}': {data.get('version')}")
+        return data['blocks']
     
     def _parse_content(self, content):
         """
         Parse markdown content with support for all elements
         """
         lines = content.split('\n')
+        blocks = []
+        anchors = {}
         i = 0
         
+        # Pre-scan reference link and footnote definitions so inline parsing
+        # can resolve references that appear before their definitions
+        self._definitions = DefinitionIndex.scan(lines)
+        
         while i < len(lines):
             line = lines[i]
             
-            # Skip empty lines
-            if not line.strip():
+            # Skip empty lines and the definitions themselves
+            if not line.strip() or i in self._definitions.lines:
                 i += 1
                 continue
             
             # Parse different elements
             if self._is_heading(line):
-                self._add_heading(line)
+                self._parse_heading(line, i + 1, blocks, anchors)
             elif self._is_code_block_start(line):
-                i = self._parse_code_block(lines, i)
+                i = self._parse_code_block(lines, i, blocks)
             elif self._is_table_line(line):
-                i = self._parse_table(lines, i)
+                i = self._parse_table(lines, i, blocks)
             elif self._is_blockquote(line):
-                i = self._parse_blockquote(lines, i)
+                i = self._parse_blockquote(lines, i, blocks)
             elif self._is_list_item(line):
-                i = self._parse_list(lines, i)
+                i = self._parse_list(lines, i, blocks)
             elif self._is_task_list(line):
-                i = self._parse_task_list(lines, i)
+                i = self._parse_task_list(lines, i, blocks)
             elif self._is_horizontal_rule(line):
-                self._add_horizontal_rule()
+                blocks.append({'type': 'hr'})
             else:
-                self._add_paragraph(line)
+                blocks.append({'type': 'paragraph', 'spans': self._parse_inline(line)})
             
             i += 1
+        
+        return blocks
     
     def _is_heading(self, line):
         return line.strip().startswith('#')
@@ -239,14 +829,16 @@ class AdvancedMarkdownConverter:
     def _is_horizontal_rule(self, line):
         return re.match(r'^\s*[\*\-_]{3,}\s*$', line)
     
-    def _add_heading(self, line):
+    def _parse_heading(self, line, line_number, blocks, anchors):
         match = re.match(r'^(#+)\s*(.*)$', line)
         if match:
             level = len(match.group(1))
             text = match.group(2).strip()
-            self.document.add_heading(text, level=min(level, 6))
+            anchor = _unique_anchor(_slugify(text), anchors)
+            blocks.append({'type': 'heading', 'level': min(level, 6), 'text': text,
+                           'anchor': anchor, 'line': line_number})
     
-    def _parse_code_block(self, lines, start_index):
+    def _parse_code_block(self, lines, start_index, blocks):
         """Parse code block and return end index"""
         code_lines = []
         i = start_index + 1
@@ -255,15 +847,11 @@ class AdvancedMarkdownConverter:
             code_lines.append(lines[i])
             i += 1
         
-        code_content = '\n'.join(code_lines)
-        p = self.document.add_paragraph()
-        run = p.add_run(code_content)
-        run.font.name = 'Courier New'
-        run.font.size = Pt(10)
+        blocks.append({'type': 'code', 'text': '\n'.join(code_lines)})
         
         return i
     
-    def _parse_table(self, lines, start_index):
+    def _parse_table(self, lines, start_index, blocks):
         """Parse table and return end index"""
         table_lines = []
         i = start_index
@@ -280,28 +868,18 @@ class AdvancedMarkdownConverter:
             # Skip separator line
             data_lines = table_lines[2:] if len(table_lines) > 2 else []
             
-            # Create table
-            table = self.document.add_table(rows=1, cols=len(header_cells))
-            
-            # Add header
-            for j, header in enumerate(header_cells):
-                table.cell(0, j).text = header
-                # Make header bold
-                for paragraph in table.cell(0, j).paragraphs:
-                    for run in paragraph.runs:
-                        run.bold = True
-            
-            # Add data rows
+            # Keep only rows matching the header width
+            rows = []
             for line in data_lines:
                 data_cells = [cell.strip() for cell in line.split('|')[1:-1]]
                 if len(data_cells) == len(header_cells):
-                    row = table.add_row()
-                    for j, data in enumerate(data_cells):
-                        row.cells[j].text = data
+                    rows.append(data_cells)
+            
+            blocks.append({'type': 'table', 'header': header_cells, 'rows': rows})
         
         return i - 1
     
-    def _parse_blockquote(self, lines, start_index):
+    def _parse_blockquote(self, lines, start_index, blocks):
         """Parse blockquote and return end index"""
         quote_lines = []
         i = start_index
@@ -311,14 +889,11 @@ class AdvancedMarkdownConverter:
             quote_lines.append(quote_line)
             i += 1
         
-        quote_text = ' '.join(quote_lines)
-        p = self.document.add_paragraph()
-        p.style = 'Quote'
-        p.add_run(quote_text)
+        blocks.append({'type': 'quote', 'text': ' '.join(quote_lines)})
         
         return i - 1
     
-    def _parse_list(self, lines, start_index):
+    def _parse_list(self, lines, start_index, blocks):
         """Parse list and return end index"""
         i = start_index
         
@@ -329,18 +904,19 @@ class AdvancedMarkdownConverter:
             if re.match(r'^\s*\d+\.\s+', line):
                 # Ordered list
                 content = re.sub(r'^\s*\d+\.\s+', '', line)
-                p = self.document.add_paragraph(style='List Number')
+                ordered = True
             else:
                 # Unordered list
                 content = re.sub(r'^\s*[\*\-\+]\s+', '', line)
-                p = self.document.add_paragraph(style='List Bullet')
+                ordered = False
             
-            self._add_formatted_text(p, content)
+            blocks.append({'type': 'list_item', 'ordered': ordered,
+                           'spans': self._parse_inline(content)})
             i += 1
         
         return i - 1
     
-    def _parse_task_list(self, lines, start_index):
+    def _parse_task_list(self, lines, start_index, blocks):
         """Parse task list and return end index"""
         i = start_index
         
@@ -353,66 +929,374 @@ class AdvancedMarkdownConverter:
             # Extract task content
             content = re.sub(r'^\s*[\*\-\+]\s+\[[\sx]\]\s+', '', line)
             
-            p = self.document.add_paragraph(style='List Bullet')
-            checkbox = '☑' if is_completed else '☐'
-            p.add_run(f"{checkbox} ")
-            self._add_formatted_text(p, content)
+            blocks.append({'type': 'task_item', 'checked': is_completed,
+                           'spans': self._parse_inline(content)})
             
             i += 1
         
         return i - 1
     
-    def _add_horizontal_rule(self):
-        """Add horizontal rule"""
-        p = self.document.add_paragraph()
-        p.add_run('_' * 50)
+    def _parse_inline(self, text):
+        """
+        Split text into inline spans, see inline_parser.parse_inline
+        """
+        return parse_inline(text, definitions=self._definitions)
+    
+    def _render_blocks(self, document, blocks, chapter=''):
+        """
+        Write a block tree into document.
+        
+        Headings are bookmarked so links to '#anchor' (or to another chapter
+        in book mode) can target them.
+        """
+        self._chapter = chapter
+        
+        for block in blocks:
+            block_type = block['type']
+            
+            if block_type == 'heading':
+                p = document.add_heading(block['text'], level=block['level'])
+                bookmark = self._claim_bookmark(document, chapter, block['anchor'])
+                self._add_bookmark(p, bookmark)
+                if self._toc_entries is not None and block['level'] <= TOC_LEVELS:
+                    self._toc_entries.append((block['level'], block['text'], bookmark))
+            elif block_type == 'code':
+                self._add_code_block(document, block['text'])
+            elif block_type == 'table':
+                self._add_table(document, block['header'], block['rows'])
+            elif block_type == 'quote':
+                p = document.add_paragraph()
+                p.style = 'Quote'
+                p.add_run(block['text'])
+            elif block_type == 'list_item':
+                style = 'List Number' if block['ordered'] else 'List Bullet'
+                p = document.add_paragraph(style=style)
+                self._add_formatted_text(p, block['spans'])
+            elif block_type == 'task_item':
+                p = document.add_paragraph(style='List Bullet')
+                checkbox = '☑' if block['checked'] else '☐'
+                p.add_run(f"{checkbox} ")
+                self._add_formatted_text(p, block['spans'])
+            elif block_type == 'hr':
+                self._add_horizontal_rule(document)
+            elif block_type == 'paragraph':
+                p = document.add_paragraph()
+                self._add_formatted_text(p, block['spans'])
     
-    def _add_paragraph(self, text):
-        """Add paragraph with formatting"""
-        p = self.document.add_paragraph()
-        self._add_formatted_text(p, text)
+    def _add_code_block(self, document, code_content):
+        """Add code block"""
+        p = document.add_paragraph()
+        run = p.add_run(code_content)
+        run.font.name = 'Courier New'
+        run.font.size = Pt(10)
     
-    def _add_formatted_text(self, paragraph, text):
-        """Add text with inline formatting (bold, italic, code, etc.)"""
-        # Handle links first
-        text = self._process_links(paragraph, text)
+    def _add_table(self, document, header_cells, rows):
+        """Add table with a bold header row"""
+        table = document.add_table(rows=1, cols=len(header_cells))
         
-        # Handle inline formatting
-        parts = re.split(r'(\*\*.*?\*\*|\*.*?\*|`.*?`|~~.*?~~)', text)
+        # Add header
+        for j, header in enumerate(header_cells):
+            table.cell(0, j).text = header
+            # Make header bold
+            for paragraph in table.cell(0, j).paragraphs:
+                for run in paragraph.runs:
+                    run.bold = True
         
-        for part in parts:
-            if part.startswith('**') and part.endswith('**'):
-                run = paragraph.add_run(part[2:-2])
+        # Add data rows
+        for data_cells in rows:
+            row = table.add_row()
+            for j, data in enumerate(data_cells):
+                row.cells[j].text = data
+    
+    def _add_horizontal_rule(self, document):
+        """Add horizontal rule"""
+        p = document.add_paragraph()
+        p.add_run('_' * 50)
+    
+    def _add_formatted_text(self, paragraph, spans):
+        """Add inline spans (bold, italic, code, links, etc.) as runs"""
+        for span in spans:
+            text, style = span[0], span[1]
+            if style == 'footnote':
+                self._add_footnote(paragraph, span[2])
+                continue
+            run = paragraph.add_run(text)
+            
+            if style == 'bold':
                 run.bold = True
-            elif part.startswith('*') and part.endswith('*'):
-                run = paragraph.add_run(part[1:-1])
+            elif style == 'italic':
                 run.italic = True
-            elif part.startswith('`') and part.endswith('`'):
-                run = paragraph.add_run(part[1:-1])
+            elif style == 'code':
                 run.font.name = 'Courier New'
-            elif part.startswith('~~') and part.endswith('~~'):
-                run = paragraph.add_run(part[2:-2])
+            elif style == 'strike':
                 run.font.strike = True
+            elif style == 'link':
+                bookmark = self._resolve_anchor(span[2])
+                if bookmark:
+                    _wrap_in_hyperlink(paragraph, run, bookmark)
+                else:
+                    url, bookmark = _docx_link_target(span[2])
+                    _wrap_in_hyperlink(paragraph, run, bookmark, url=url)
+                run.underline = True
+    
+    def _add_footnote(self, paragraph, note_spans):
+        """
+        Add a footnote reference to paragraph and the note to the footnotes part
+        """
+        self._footnotes_for(paragraph.part).add(
+            paragraph, lambda note: self._add_formatted_text(note, note_spans))
+    
+    def _footnotes_for(self, document_part):
+        """
+        Return the FootnoteWriter for a document, reused while it is rendered
+        """
+        if self._footnotes is None or self._footnotes.document_part is not document_part:
+            self._footnotes = FootnoteWriter(document_part)
+        return self._footnotes
+    
+    def _flush_footnotes(self, document):
+        """Write edited footnotes back into a template's blob part"""
+        if self._footnotes is not None and self._footnotes.document_part is document.part:
+            self._footnotes.flush()
+    
+    def _claim_bookmark(self, document, chapter, anchor):
+        """
+        Return the bookmark name for a chapter's anchor, raising ValueError
+        if another heading in document already has that name
+        """
+        if self._bookmarks is None or self._bookmarks[0] is not document.part:
+            self._bookmarks = (document.part, {})
+        bookmark = _bookmark_name(chapter, anchor)
+        owner = self._bookmarks[1].setdefault(bookmark, (chapter, anchor))
+        if owner != (chapter, anchor):
+            raise ValueError(f"Headings '{owner[0]}#{owner[1]}' and '{chapter}#{anchor}' "
+                             f"both map to the bookmark '{bookmark}'")
+        return bookmark
+    
+    def _resolve_anchor(self, url):
+        """Return the bookmark name for an in-document link, or None"""
+        target, _, anchor = url.partition('#')
+        if not target:
+            return _bookmark_name(self._chapter, anchor) if anchor else None
+        
+        chapter = self._book_chapters.get(os.path.normpath(os.path.join(self._chapter_dir, target)))
+        if chapter is None:
+            return None
+        return _bookmark_name(chapter, anchor)
+    
+    def _start_toc(self, document, toc):
+        """
+        Begin collecting headings for a table of contents.
+        
+        Returns the body element the contents will follow (False when no
+        table of contents was requested, None for the start of the body).
+        """
+        if not toc:
+            return False
+        self._toc_entries = []
+        sectPr = document.element.body.find(qn('w:sectPr'))
+        if sectPr is not None:
+            return sectPr.getprevious()
+        return document.element.body[-1] if len(document.element.body) else None
+    
+    def _finish_toc(self, document, position):
+        """
+        Insert the collected table of contents at the position from _start_toc
+        """
+        if position is False:
+            return
+        entries, self._toc_entries = self._toc_entries, None
+        if entries:
+            _insert_toc(document, position, entries)
+    
+    def _add_bookmark(self, paragraph, name):
+        """Wrap the contents of paragraph in a bookmark"""
+        start, end = self._new_bookmark(name)
+        p = paragraph._p
+        if p.pPr is not None:
+            p.pPr.addnext(start)
+        else:
+            p.insert(0, start)
+        p.append(end)
+    
+    def _add_bookmark_marker(self, document, name):
+        """Add an empty bookmark at the current end of the document body"""
+        body = document.element.body
+        sectPr = body.find(qn('w:sectPr'))
+        for element in self._new_bookmark(name):
+            if sectPr is not None:
+                sectPr.addprevious(element)
             else:
-                paragraph.add_run(part)
+                body.append(element)
     
-    def _process_links(self, paragraph, text):
-        """Process markdown links"""
-        # Simple link processing - could be enhanced
-        link_pattern = r'\[([^\]]+)\]\(([^\)]+)\)'
+    def _new_bookmark(self, name):
+        """Create a bookmarkStart/bookmarkEnd pair with a fresh id"""
+        bookmark_id = str(self._next_bookmark_id)
+        self._next_bookmark_id += 1
         
-        def replace_link(match):
-            link_text = match.group(1)
-            url = match.group(2)
-            
-            # Add hyperlink (simplified - Word hyperlinks are complex)
-            run = paragraph.add_run(link_text)
-            run.font.color.rgb = None  # Default blue color
-            run.underline = True
-            
-            return ""  # Return empty string to remove from text
+        start = OxmlElement('w:bookmarkStart')
+        start.set(qn('w:id'), bookmark_id)
+        start.set(qn('w:name'), name)
+        end = OxmlElement('w:bookmarkEnd')
+        end.set(qn('w:id'), bookmark_id)
+        return start, end
+
+
+def _slugify(text):
+    """
+    GitHub-style heading anchor: lowercase, punctuation dropped, spaces to dashes
+    """
+    text = re.sub(r'[^\w\s-]', '', text.strip().lower())
+    return re.sub(r'\s', '-', text)
+
+
+def _unique_anchor(anchor, seen):
+    """Suffix repeated anchors with -1, -2, ... as GitHub does"""
+    count = seen.get(anchor, 0)
+    seen[anchor] = count + 1
+    return f"{anchor}-{count}" if count else anchor
+
+
+def _chapter_prefixes(chapters, base_dir):
+    """
+    Map each chapter's absolute path to its anchor prefix.
+    
+    The prefix is the slug of the path relative to base_dir, so chapters
+    with the same file name in different directories stay distinct.
+    """
+    prefixes = {}
+    # Chapter bookmark name -> path; a name maps back to one prefix
+    paths = {}
+    for path in chapters:
+        path = os.path.abspath(path)
+        relative = os.path.splitext(os.path.relpath(path, base_dir))[0]
+        prefix = _slugify(relative.replace(os.sep, '-').replace('/', '-'))
+        bookmark = _bookmark_name(prefix, '')
+        if bookmark in paths:
+            raise ValueError(f"Chapters '{paths[bookmark]}' and '{path}' both use "
+                             f"the bookmark '{bookmark}'")
+        paths[bookmark] = path
+        prefixes[path] = prefix
+    return prefixes
+
+
+def _wrap_in_hyperlink(paragraph, run, bookmark=None, url=None):
+    """Move run into a hyperlink to a bookmark or an external url"""
+    hyperlink = OxmlElement('w:hyperlink')
+    if bookmark:
+        hyperlink.set(qn('w:anchor'), bookmark)
+    if url:
+        r_id = paragraph.part.relate_to(url, RT.HYPERLINK, is_external=True)
+        hyperlink.set(qn('r:id'), r_id)
+    run._r.addprevious(hyperlink)
+    hyperlink.append(run._r)
+    run.font.color.rgb = HYPERLINK_COLOR
+
+
+def _link_spans(spans):
+    """Yield the link spans in spans, including those inside footnotes"""
+    for span in spans:
+        if span[1] == 'link':
+            yield span
+        elif span[1] == 'footnote':
+            yield from _link_spans(span[2])
+
+
+def _docx_link_target(url):
+    """
+    Split a link to a bookmark in another DOCX file ('part.docx#name') into
+    (file, bookmark name), as Word stores it; other urls have no bookmark
+    """
+    target, _, fragment = url.partition('#')
+    if fragment and target.lower().endswith('.docx') and '://' not in target:
+        return target, fragment
+    return url, None
+
+
+def _insert_toc(document, position, entries):
+    """
+    Insert a table of contents after the body element position (None for
+    the start of the body).
+    
+    entries are (level, text, bookmark) tuples. They are written as the
+    cached result of a TOC field, so viewers show them as rendered and Word
+    only rebuilds them (adding page numbers) when the user updates the field.
+    """
+    title = document.add_paragraph('Contents')
+    try:
+        title.style = document.styles['TOC Heading']
+    except KeyError:
+        title.runs[0].bold = True
+    paragraphs = [title]
+    
+    for level, text, bookmark in entries:
+        p = document.add_paragraph()
+        try:
+            p.style = document.styles[f'toc {level}']
+        except KeyError:
+            p.paragraph_format.left_indent = Inches(0.25 * (level - 1))
+        
+        if len(paragraphs) == 1:
+            _add_field_char(p, 'begin')
+            instr = OxmlElement('w:instrText')
+            instr.set(qn('xml:space'), 'preserve')
+            instr.text = f' TOC \\o "1-{TOC_LEVELS}" \\h \\z \\u '
+            p.add_run()._r.append(instr)
+            _add_field_char(p, 'separate')
         
-        return re.sub(link_pattern, replace_link, text)
+        _wrap_in_hyperlink(p, p.add_run(text), bookmark)
+        paragraphs.append(p)
+    
+    _add_field_char(paragraphs[-1], 'end')
+    
+    # Move the contents from the end of the body into place
+    body = document.element.body
+    for p in reversed(paragraphs):
+        if position is None:
+            body.insert(0, p._p)
+        else:
+            position.addnext(p._p)
+
+
+def _add_field_char(paragraph, field_char_type):
+    """Append a w:fldChar run of the given type (begin/separate/end)"""
+    field_char = OxmlElement('w:fldChar')
+    field_char.set(qn('w:fldCharType'), field_char_type)
+    paragraph.add_run()._r.append(field_char)
+
+
+def _bookmark_name(chapter, anchor):
+    """
+    Word bookmark name for a heading anchor within a chapter.
+    
+    Word limits names to 40 letters, digits and underscores, so the mapping
+    is kept one-to-one: when chapter and anchor are words joined by single
+    hyphens they are written as 'h_<chapter>__<anchor>' with the hyphens
+    turned into underscores, and anything else (or anything too long) falls
+    back to a hash of the chapter and anchor, which has no double underscore.
+    """
+    if BOOKMARK_PART.match(chapter) and BOOKMARK_PART.match(anchor):
+        name = f"h_{chapter}__{anchor}".replace('-', '_')
+        if len(name) <= 40:
+            return name
+    digest = hashlib.sha1(f"{chapter}#{anchor}".encode('utf-8')).hexdigest()
+    return f"h_{digest[:20]}"
+
+
+def _estimate_block_bytes(block):
+    """
+    Rough size of a block once written as document XML
+    """
+    return len(json.dumps(block, ensure_ascii=False).encode('utf-8')) + BLOCK_XML_OVERHEAD
+
+
+def _render_blocks_to_file(blocks, output_docx_path, template_path, optimize=False,
+                           compression_level=None):
+    """
+    Worker entry point for AdvancedMarkdownConverter._render_many
+    """
+    converter = AdvancedMarkdownConverter(optimize=optimize, compression_level=compression_level)
+    return converter.render(blocks, output_docx_path, template_path)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Inline Parser Benchmark
+=======================
+
+Runs the inline markdown tokenizer over adversarial single-line inputs
+(long asterisk runs, thousands of unmatched brackets, giant paragraphs)
+and exits with status 1 if throughput falls below MIN_CHARS_PER_SECOND.
+
+A quadratic parser takes minutes on these inputs; the linear scanner in
+inline_parser.py handles each in well under a second.
+"""
+
+import sys
+import time
+
+from inline_parser import DefinitionIndex, parse_inline
+
+# Fail the run below this many input characters parsed per second; a
+# quadratic parser manages only a few thousand on these inputs
+MIN_CHARS_PER_SECOND = 250_000
+
+# Each case is (name, text); every text is a single line of roughly 1 MB
+CASES = [
+    ("Long asterisk run", "*" * 1_000_001),
+    ("Asterisks between words", "a *" * 333_333),
+    ("Alternating backticks", "`a " * 333_333 + "`"),
+    ("Lone tildes", "~a " * 333_333),
+    ("Unmatched open brackets", "[" * 1_000_000),
+    ("Brackets without targets", "[a] " * 250_000),
+    ("Unclosed link targets", "[a](b " * 166_666),
+    ("Empty emphasis pairs", "a**" * 333_333),
+    ("Unresolved references", "[a][b] [c] [^d] " * 62_500),
+    ("Nested brackets under a long label", ("[ " * 490 + "] ") * 1_018),
+    ("Giant paragraph", "Some **bold**, *italic*, `code` and [a link](https://example.com). " * 15_000),
+]
+
+# Definitions for the modes that resolve references and footnotes
+DEFINITIONS = DefinitionIndex.scan([
+    "[a]: https://example.com/a",
+    "[reference label]: https://example.com/long",
+    # Near MAX_LABEL_LENGTH, so most bracket runs are short enough to look up
+    "[" + "long label " * 90 + "]: https://example.com/longest",
+    "[^1]: A footnote.",
+])
+
+# (description, keyword arguments) for each converter's use of the parser
+PARSER_MODES = [
+    ("AdvancedMarkdownConverter", {}),
+    ("AdvancedMarkdownConverter with definitions", {"definitions": DEFINITIONS}),
+    ("MarkdownToDocxConverter", {"links": False, "strike": False}),
+    ("MarkdownToDocxConverter with footnotes", {"links": False, "strike": False,
+                                               "definitions": DEFINITIONS}),
+]
+
+
+def run_benchmark():
+    """Time every case in every parser mode; return True if all pass"""
+    passed = True
+
+    for mode, options in PARSER_MODES:
+        print(f"\n--- {mode} ---")
+        for name, text in CASES:
+            start_time = time.perf_counter()
+            spans = parse_inline(text, **options)
+            elapsed = time.perf_counter() - start_time
+
+            throughput = len(text) / max(elapsed, 1e-9)
+            ok = throughput >= MIN_CHARS_PER_SECOND
+            passed = passed and ok
+
+            status = "✅" if ok else "❌"
+            print(f"{status} {name}: {len(text):,} chars, {len(spans):,} spans, "
+                  f"{elapsed:.3f}s ({throughput / 1e6:.1f}M chars/s)")
+
+    return passed
+
+
+if __name__ == "__main__":
+    print("=== Inline Parser Benchmark ===")
+    if not run_benchmark():
+        print(f"\n❌ Throughput below {MIN_CHARS_PER_SECOND:,} chars/s")
+        sys.exit(1)
+    print("\n✅ All cases above threshold")
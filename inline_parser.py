@@ -0,0 +1,309 @@
+"""
+Linear-time inline markdown tokenizer shared by the python-docx converters.
+
+The converters used to split lines with lazy regex alternations such as
+``(\\*\\*.*?\\*\\*|\\*.*?\\*|`.*?`)``. On lines with many unmatched ``*``,
+backticks or ``[`` every candidate opener rescans the rest of the line,
+which is quadratic. This scanner looks up closing delimiters through a
+forward-only cache instead, so every character is examined a bounded
+number of times however the input is shaped.
+"""
+import re
+
+# Characters that can open an emphasis span
+EMPHASIS_START = re.compile(r'[*`~]')
+
+# [label]: url "optional title"
+LINK_DEFINITION = re.compile(
+    r'^ {0,3}\[([^\]^][^\]]*)\]:\s*<?([^\s>]+)>?'
+    r'(?:\s+(?:"[^"]*"|\'[^\']*\'|\([^)]*\)))?\s*$')
+
+# (url "optional title") or (<url>) of an inline link
+INLINE_DESTINATION = re.compile(
+    r'\s*(?:<([^<>\n]*)>|([^\s<>]+))'
+    r'(?:\s+(?:"[^"]*"|\'[^\']*\'))?\s*')
+
+# [^label]: footnote text
+FOOTNOTE_DEFINITION = re.compile(r'^ {0,3}\[\^([^\]]+)\]:\s*(.*)$')
+
+# Definitions kept per DefinitionIndex, and the longest label accepted
+MAX_DEFINITIONS = 10000
+MAX_LABEL_LENGTH = 999
+
+
+class _NextFinder:
+    """
+    Find the next occurrence of a delimiter at or after a position.
+
+    Lookups must come with non-decreasing positions. A cached hit is reused
+    until the scan moves past it, and a miss is remembered for the rest of
+    the text, so the text is searched at most once per delimiter.
+    """
+
+    def __init__(self, text, delimiter):
+        self.text = text
+        self.delimiter = delimiter
+        self.found = -2  # -2: not searched yet, -1: no further occurrence
+
+    def find(self, position):
+        if self.found == -1:
+            return -1
+        if self.found < position:
+            self.found = self.text.find(self.delimiter, position)
+        return self.found
+
+
+# Delimiters tried in this order at each position, matching the precedence
+# of the old regex alternation
+EMPHASIS_DELIMITERS = [
+    ('**', 'bold'),
+    ('*', 'italic'),
+    ('`', 'code'),
+    ('~~', 'strike'),
+]
+
+
+def parse_inline(text, links=True, strike=True, definitions=None):
+    """
+    Split text into inline spans.
+
+    Each span is a list of [text, style] or [text, 'link', url], where
+    style is '' (plain), 'bold', 'italic', 'code' or 'strike'. Links are
+    matched first and emphasis never crosses a link.
+
+    With a DefinitionIndex, reference links ([text][ref], [text][] and
+    [ref]) resolve to 'link' spans, and footnote references [^label] become
+    [label, 'footnote', note_spans] with the note text already parsed.
+    links=False leaves all links as text but still resolves footnotes.
+    """
+    return _parse_inline(text, links, strike, definitions, footnotes=True)
+
+
+def _parse_inline(text, links, strike, definitions, footnotes):
+    spans = []
+    delimiters = [(delimiter, style) for delimiter, style in EMPHASIS_DELIMITERS
+                  if strike or style != 'strike']
+    finders = {delimiter: _NextFinder(text, delimiter) for delimiter, _ in delimiters}
+
+    position = 0
+    if links or definitions is not None:
+        for start, end, span in _find_links(text, definitions, footnotes, links):
+            _parse_emphasis(text, position, start, delimiters, finders, spans)
+            if span[1] == 'footnote':
+                # Notes cannot contain further footnotes
+                span.append(_parse_inline(definitions.footnotes[span[0]], links, strike,
+                                          definitions, footnotes=False))
+            spans.append(span)
+            position = end
+
+    _parse_emphasis(text, position, len(text), delimiters, finders, spans)
+    return spans
+
+
+def _link_destination(destination):
+    """Return the url of an inline link's (url "title"), as written if it does not parse"""
+    match = INLINE_DESTINATION.fullmatch(destination)
+    if match is None:
+        return destination
+    return match.group(1) if match.group(1) is not None else match.group(2)
+
+
+def _find_links(text, definitions=None, footnotes=True, links=True):
+    """
+    Yield (start, end, span) for each link, leftmost first; with
+    links=False only footnote references are yielded.
+
+    Without definitions this is equivalent to
+    re.finditer(r'\\[([^\\]]+)\\]\\(([^\\)]+)\\)', text), with the url
+    taken out of its angle brackets and any title dropped. Labels are only sliced
+    out for lookup when they contain no '[' and are no longer than the
+    longest defined label. Nested openers share one closing ']', so without
+    the '[' check each of them would slice the same text again.
+    """
+    open_bracket = _NextFinder(text, '[')
+    close_bracket = _NextFinder(text, ']')
+    close_paren = _NextFinder(text, ')')
+    close_reference = _NextFinder(text, ']')
+    max_label = definitions.max_label_length if definitions is not None else 0
+    position = 0
+
+    while True:
+        start = text.find('[', position)
+        if start == -1:
+            return
+
+        label_end = close_bracket.find(start + 1)
+        if label_end == -1:
+            return
+
+        # The label runs to the first ']' and must be non-empty
+        if links and label_end > start + 1 and text.startswith('(', label_end + 1):
+            url_end = close_paren.find(label_end + 2)
+            if url_end > label_end + 2:
+                link = [text[start + 1:label_end], 'link',
+                        _link_destination(text[label_end + 2:url_end])]
+                yield start, url_end + 1, link
+                position = url_end + 1
+                continue
+
+        # Reference labels cannot contain brackets
+        next_open = open_bracket.find(start + 1)
+        nested = next_open != -1 and next_open < label_end
+
+        if definitions is not None and label_end > start + 1 and not nested:
+            label_length = label_end - start - 1
+
+            # Footnote reference: [^label]
+            if footnotes and text.startswith('^', start + 1) and label_length <= max_label + 1:
+                note_label = _normalize_label(text[start + 2:label_end])
+                if note_label in definitions.footnotes:
+                    yield start, label_end + 1, [note_label, 'footnote']
+                    position = label_end + 1
+                    continue
+
+            # Full or collapsed reference: [text][ref] or [text][]
+            if links and text.startswith('[', label_end + 1):
+                reference_end = close_reference.find(label_end + 2)
+                reference_length = reference_end - label_end - 2
+                if 0 < reference_length <= max_label or (
+                        reference_length == 0 and label_length <= max_label):
+                    reference = text[label_end + 2:reference_end] or text[start + 1:label_end]
+                    url = definitions.links.get(_normalize_label(reference))
+                    if url is not None:
+                        yield start, reference_end + 1, [text[start + 1:label_end], 'link', url]
+                        position = reference_end + 1
+                        continue
+
+            # Shortcut reference: [ref]
+            if links and label_length <= max_label:
+                url = definitions.links.get(_normalize_label(text[start + 1:label_end]))
+                if url is not None:
+                    yield start, label_end + 1, [text[start + 1:label_end], 'link', url]
+                    position = label_end + 1
+                    continue
+
+        position = start + 1
+
+
+class DefinitionIndex:
+    """
+    Link and footnote definitions collected in a pre-scan of a document.
+
+    add_lines consumes any iterable of lines (an open file works), keeping
+    only the definitions and the numbers of the lines they occupy, so a
+    large input never has to be held in memory. At most max_definitions
+    are indexed; later definitions are left in the text unresolved.
+    """
+
+    def __init__(self, max_definitions=MAX_DEFINITIONS):
+        self.max_definitions = max_definitions
+        self.links = {}
+        self.footnotes = {}
+        # 0-based numbers of lines holding definitions, skipped when rendering,
+        # and the subset holding footnotes
+        self.lines = set()
+        self.footnote_lines = set()
+        self.max_label_length = 0
+
+    @classmethod
+    def scan(cls, lines, max_definitions=MAX_DEFINITIONS):
+        index = cls(max_definitions)
+        index.add_lines(lines)
+        return index
+
+    def add_lines(self, lines, first_line=0):
+        """
+        Index the definitions in lines, numbering lines from first_line
+        """
+        in_code_block = False
+        footnote = None
+
+        for number, line in enumerate(lines, first_line):
+            line = line.rstrip('\r\n')
+            if line.lstrip().startswith('```'):
+                in_code_block = not in_code_block
+                footnote = None
+                continue
+
+            # Indented lines continue the footnote defined just above
+            if footnote is not None and line.startswith('    ') and line.strip():
+                self.footnotes[footnote] += ' ' + line.strip()
+                self.lines.add(number)
+                self.footnote_lines.add(number)
+                continue
+            footnote = None
+
+            if in_code_block or not line.lstrip().startswith('['):
+                continue
+            if len(self.links) + len(self.footnotes) >= self.max_definitions:
+                continue
+
+            match = FOOTNOTE_DEFINITION.match(line)
+            if match:
+                label = self._add(self.footnotes, match.group(1), match.group(2).strip())
+                if label is not None:
+                    footnote = label
+                    self.lines.add(number)
+                    self.footnote_lines.add(number)
+                continue
+
+            match = LINK_DEFINITION.match(line)
+            if match and self._add(self.links, match.group(1), match.group(2)) is not None:
+                self.lines.add(number)
+
+    def _add(self, definitions, label, value):
+        """Add a definition unless its label is taken; the first one wins"""
+        label = _normalize_label(label)
+        if not label or len(label) > MAX_LABEL_LENGTH or '[' in label or label in definitions:
+            return None
+        definitions[label] = value
+        self.max_label_length = max(self.max_label_length, len(label))
+        return label
+
+
+def _normalize_label(label):
+    """Labels match case-insensitively with runs of whitespace collapsed"""
+    return ' '.join(label.split()).lower()
+
+
+def _parse_emphasis(text, start, end, delimiters, finders, spans):
+    """Append emphasis and plain spans for text[start:end]"""
+    # Plain pieces separated only by empty emphasis are joined into one span
+    plain = []
+    plain_start = start
+    position = start
+
+    while True:
+        match = EMPHASIS_START.search(text, position, end)
+        if not match:
+            break
+        position = match.start()
+
+        for delimiter, style in delimiters:
+            if not text.startswith(delimiter, position):
+                continue
+            size = len(delimiter)
+            closer = finders[delimiter].find(position + size)
+            if closer == -1 or closer + size > end:
+                continue
+
+            plain.append(text[plain_start:position])
+            if closer > position + size:
+                _flush_plain(plain, spans)
+                spans.append([text[position + size:closer], style])
+            position = closer + size
+            plain_start = position
+            break
+        else:
+            position += 1
+
+    plain.append(text[plain_start:end])
+    _flush_plain(plain, spans)
+
+
+def _flush_plain(plain, spans):
+    """Append the collected plain pieces as one span and reset them"""
+    joined = ''.join(plain)
+    if joined:
+        spans.append([joined, ''])
+    plain.clear()
@@ -2,6 +2,8 @@ from docx import Document
 from docx.shared import Inches, Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 import re
+from inline_parser import DefinitionIndex, parse_inline
+from docx_footnotes import FootnoteWriter
 
 class MarkdownToDocxConverter:
     def __init__(self, template_path=None):
@@ -9,6 +11,9 @@ class MarkdownToDocxConverter:
             self.document = Document(template_path)
         else:
             self.document = Document()
+        # Footnote definitions of the file being converted, and the notes written so far
+        self._definitions = None
+        self._footnotes = None
 
     def _add_heading(self, text, level):
         # Map Markdown heading levels to Word's built-in heading styles
@@ -23,21 +28,30 @@ class MarkdownToDocxConverter:
         self._add_text_with_formatting(p, text)
 
     def _add_text_with_formatting(self, paragraph, text):
-        # Handle bold, italic, and inline code
-        # This is a simplified approach and might not cover all edge cases
-        parts = re.split(r'(\**.*?\**|\*.*?\*|`.*?`)', text)
-        for part in parts:
-            if part.startswith('**') and part.endswith('**'):
-                run = paragraph.add_run(part[2:-2])
+        # Handle bold, italic, inline code and footnote references
+        # parse_inline scans each line in linear time, even with unmatched markers
+        spans = parse_inline(text, links=False, strike=False, definitions=self._definitions)
+        self._add_spans(paragraph, spans)
+
+    def _add_spans(self, paragraph, spans):
+        for span in spans:
+            part, style = span[0], span[1]
+            if style == 'footnote':
+                self._add_footnote(paragraph, span[2])
+                continue
+            run = paragraph.add_run(part)
+            if style == 'bold':
                 run.bold = True
-            elif part.startswith('*') and part.endswith('*'):
-                run = paragraph.add_run(part[1:-1])
+            elif style == 'italic':
                 run.italic = True
-            elif part.startswith('`') and part.endswith('`'):
-                run = paragraph.add_run(part[1:-1])
+            elif style == 'code':
                 run.font.name = 'Courier New' # Or a suitable monospace font
-            else:
-                paragraph.add_run(part)
+
+    def _add_footnote(self, paragraph, note_spans):
+        # Word footnote: a reference mark here, the note in the footnotes part
+        if self._footnotes is None:
+            self._footnotes = FootnoteWriter(self.document.part)
+        self._footnotes.add(paragraph, lambda note: self._add_spans(note, note_spans))
 
     def _add_list_item(self, text, level, ordered=False):
         # Use 'List Paragraph' style and handle indentation manually for now
@@ -85,13 +99,16 @@ class MarkdownToDocxConverter:
         with open(markdown_file_path, 'r') as f:
             lines = f.readlines()
 
+        # Pre-scan footnote definitions so references can come before them
+        self._definitions = DefinitionIndex.scan(lines)
+
         in_code_block = False
         code_block_content = []
         table_header = []
         table_data = []
         in_table = False
 
-        for line in lines:
+        for number, line in enumerate(lines):
             line = line.strip()
 
             # Code blocks
@@ -108,6 +125,10 @@ class MarkdownToDocxConverter:
                 code_block_content.append(line)
                 continue
 
+            # Footnote definitions become the notes themselves
+            if number in self._definitions.footnote_lines:
+                continue
+
             # Tables
             # Check for table header (first line of a table, not inside a code block)
             if re.match(r'^\|.*\|\s*$', line) and not in_table and not in_code_block:
@@ -175,6 +196,8 @@ class MarkdownToDocxConverter:
         if in_code_block:
             self._add_code_block("\n".join(code_block_content))
 
+        if self._footnotes is not None:
+            self._footnotes.flush()
         self.document.save(output_docx_path)
         print(f"Successfully converted '{markdown_file_path}' to '{output_docx_path}'")
 